@@ -1,4 +1,4 @@
-from flask import Flask, request, jsonify, send_file, render_template, session, send_from_directory, redirect
+from flask import Flask, request, jsonify, send_file, render_template, session, send_from_directory, redirect, g
 from flask_cors import CORS
 import mysql.connector
 import bcrypt
@@ -7,6 +7,13 @@ from PIL import Image
 import io
 import base64
 import os
+import math
+import time
+
+from change_feed import LocalChangeFeed, MySQLChangeFeed, EVENT_REGISTERED, EVENT_DELETED, commit_with_event
+from audit_log import AuditLog
+from user_cache import RegisteredUserCache
+from profiler import SamplingProfiler, RequestTrace, SlowRequestLog
 
 # Import DeepFace conditionally to avoid startup issues
 try:
@@ -31,6 +38,128 @@ db_config = {
 def get_db_connection():
     return mysql.connector.connect(**db_config)
 
+# Change feed config. "mysql" tails an outbox table so every node behind the
+# load balancer sees register/delete events; "local" only covers this process.
+change_feed_config = {
+    "backend": "mysql",
+    "poll_interval": 0.5,  # seconds; upper bound on cross-node cache staleness
+    "cache_ttl": 300  # seconds; backstop for users-table writes that publish no event
+}
+
+if change_feed_config["backend"] == "mysql":
+    change_feed = MySQLChangeFeed(get_db_connection, poll_interval=change_feed_config["poll_interval"])
+else:
+    change_feed = LocalChangeFeed()
+
+# ---------------- Registered user cache ----------------
+# Only what face verification needs to locate the registered image is cached.
+# Email and role go into the session, so they are always read fresh.
+def load_registered_user(username):
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute("SELECT username, image_path FROM users WHERE username=%s", (username,))
+    row = cursor.fetchone()
+    cursor.close()
+    conn.close()
+    return row
+
+
+registered_users = RegisteredUserCache(load_registered_user, ttl=change_feed_config["cache_ttl"])
+
+
+def get_registered_user(username):
+    # Threads do not survive a fork, so make sure this worker is tailing.
+    change_feed.start()
+    return registered_users.get(username)
+
+
+def load_session_user(username):
+    """Read email and role for a new session, or None if the lookup fails."""
+    try:
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        cursor.execute("SELECT email, role FROM users WHERE username=%s", (username,))
+        user_row = cursor.fetchone()
+        cursor.close()
+        conn.close()
+        return user_row
+    except Exception as e:
+        print(f"Error getting email and role for session: {e}")
+        return None
+
+
+change_feed.subscribe(registered_users.on_change)
+change_feed.start()
+
+
+def commit_user_change(conn, cursor, event_type, username, user_id):
+    """Commit a users-table write and publish its change event."""
+    commit_with_event(change_feed, conn, cursor, event_type, username, user_id)
+
+# ---------------- Profiling ----------------
+# Every request carries a stage trace; requests slower than the threshold are
+# kept in a MySQL-backed ring buffer for the admin dashboard. The sampling
+# profiler is only active while an admin has started it. Both store results in
+# MySQL so any worker behind the load balancer can serve them.
+profiling_config = {
+    "slow_request_ms": 2000,
+    "slow_request_capacity": 100,
+    "max_profile_seconds": 60
+}
+
+sampling_profiler = SamplingProfiler(get_db_connection)
+slow_requests = SlowRequestLog(get_db_connection, profiling_config["slow_request_ms"], profiling_config["slow_request_capacity"])
+
+
+@app.before_request
+def start_request_trace():
+    g.trace = RequestTrace(request.method, request.path)
+    sampling_profiler.enter_request()
+
+
+@app.after_request
+def record_slow_request(response):
+    if "trace" in g:
+        slow_requests.maybe_record(g.trace, response.status_code)
+    return response
+
+
+@app.teardown_request
+def end_request_trace(exc):
+    sampling_profiler.exit_request()
+
+
+# ---------------- Authentication audit log ----------------
+# Login attempts are queued in memory and written to MySQL in batches by a
+# background thread, so auditing adds no database round trip to the login path.
+audit_log = AuditLog(get_db_connection)
+
+AUDITED_ENDPOINTS = {"login_email": "email", "login_face": "face"}
+
+
+@app.before_request
+def start_audit_timer():
+    if request.endpoint in AUDITED_ENDPOINTS:
+        g.audit_start = time.perf_counter()
+
+
+@app.after_request
+def record_auth_attempt(response):
+    method = AUDITED_ENDPOINTS.get(request.endpoint)
+    if method and "audit_start" in g:
+        audit_log.record(
+            method=method,
+            username=request.form.get("username", "").strip() or None,
+            outcome="success" if response.status_code == 200 else "failure",
+            status_code=response.status_code,
+            distance=g.get("audit_distance"),
+            threshold=g.get("audit_threshold"),
+            model=g.get("audit_model"),
+            latency_ms=round((time.perf_counter() - g.audit_start) * 1000, 2),
+            remote_addr=request.remote_addr
+        )
+    return response
+
 # Allowed image types
 ALLOWED_EXTENSIONS = {"png", "jpg", "jpeg"}
 
@@ -79,17 +208,19 @@ def register():
         return jsonify({"status": "error", "message": "Invalid face image"}), 400
 
     # Hash password
-    hashed_pw = bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt())
+    with g.trace.stage("bcrypt"):
+        hashed_pw = bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt())
 
     # Store in MySQL (save image path)
     try:
         conn = get_db_connection()
         cursor = conn.cursor()
-        cursor.execute(
-            "INSERT INTO users (username, email, password, image_path) VALUES (%s, %s, %s, %s)",
-            (username, email, hashed_pw, image_path)
-        )
-        conn.commit()
+        with g.trace.stage("mysql"):
+            cursor.execute(
+                "INSERT INTO users (username, email, password, image_path) VALUES (%s, %s, %s, %s)",
+                (username, email, hashed_pw, image_path)
+            )
+            commit_user_change(conn, cursor, EVENT_REGISTERED, username, cursor.lastrowid)
         cursor.close()
         conn.close()
         return jsonify({"status": "success", "message": "User registered successfully"})
@@ -132,8 +263,9 @@ def login_email():
         cursor = conn.cursor()
         
         # Check if user exists with exact email and username match
-        cursor.execute("SELECT username, password, role FROM users WHERE email=%s AND username=%s", (email, username))
-        user = cursor.fetchone()
+        with g.trace.stage("mysql"):
+            cursor.execute("SELECT username, password, role FROM users WHERE email=%s AND username=%s", (email, username))
+            user = cursor.fetchone()
         
         if not user:
             cursor.close()
@@ -147,7 +279,9 @@ def login_email():
             hashed_pw = hashed_pw.encode('utf-8')
         
         # Verify password
-        if not bcrypt.checkpw(password.encode('utf-8'), hashed_pw):
+        with g.trace.stage("bcrypt"):
+            password_ok = bcrypt.checkpw(password.encode('utf-8'), hashed_pw)
+        if not password_ok:
             cursor.close()
             conn.close()
             return jsonify({"error": "Invalid credentials. Please check your email, username, and password"}), 401
@@ -199,12 +333,8 @@ def login_face():
     
     # Quick check if user exists in database
     try:
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        cursor.execute("SELECT username FROM users WHERE username=%s", (username,))
-        user_exists = cursor.fetchone()
-        cursor.close()
-        conn.close()
+        with g.trace.stage("user_lookup"):
+            user_exists = get_registered_user(username)
         
         if not user_exists:
             print(f"User '{username}' not found in database during initial check")
@@ -222,13 +352,14 @@ def login_face():
         if not header.startswith("data:image/"):
             return jsonify({"status": "error", "message": "Invalid image data format"}), 400
             
-        image_bytes = base64.b64decode(encoded)
+        with g.trace.stage("decode_image"):
+            image_bytes = base64.b64decode(encoded)
         if len(image_bytes) < 1000:  # Minimum image size check
             return jsonify({"status": "error", "message": "Image too small or corrupted"}), 400
             
         os.makedirs("faces", exist_ok=True)
         login_image_path = f"faces/login_face_{username}.jpg"
-        with open(login_image_path, "wb") as f:
+        with g.trace.stage("save_image"), open(login_image_path, "wb") as f:
             f.write(image_bytes)
             
         print(f"Login face image saved: {login_image_path}")
@@ -240,15 +371,13 @@ def login_face():
     # Get registered image path from DB
     try:
         print(f"Looking for user in database: '{username}'")
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        
-        # Debug: Check if user exists at all
-        cursor.execute("SELECT username, email, image_path, role FROM users WHERE username=%s", (username,))
-        row = cursor.fetchone()
+        with g.trace.stage("user_lookup"):
+            row = get_registered_user(username)
         
         if not row:
             # Debug: Check all users in database
+            conn = get_db_connection()
+            cursor = conn.cursor()
             cursor.execute("SELECT username FROM users")
             all_users = cursor.fetchall()
             print(f"All users in database: {[user[0] for user in all_users]}")
@@ -257,11 +386,8 @@ def login_face():
             conn.close()
             return jsonify({"status": "error", "message": f"User '{username}' not found. Please check your username."}), 404
             
-        registered_image_path = row[2]  # image_path is the 3rd column
-        user_role = row[3] or 'user'  # role is the 4th column
-        print(f"Found user: {row[0]}, email: {row[1]}, image_path: {registered_image_path}, role: {user_role}")
-        cursor.close()
-        conn.close()
+        registered_image_path = row[1]  # image_path is the 2nd column
+        print(f"Found user: {row[0]}, image_path: {registered_image_path}")
         
     except Exception as e:
         print(f"Database error: {e}")
@@ -288,15 +414,21 @@ def login_face():
             print(f"Registered image: {registered_image_path}")
             print(f"Login image: {login_image_path}")
             
-            result = DeepFace.verify(
-                img1_path=registered_image_path,
-                img2_path=login_image_path,
-                model_name='Facenet',  # Fast and accurate
-                detector_backend='opencv',  # Fastest backend
-                enforce_detection=False,  # More lenient face detection
-                distance_metric='cosine',
-                threshold=0.6  # More lenient threshold (higher = more lenient)
-            )
+            # Covers image load, OpenCV detection and the Facenet forward pass
+            with g.trace.stage("deepface_verify_facenet"):
+                result = DeepFace.verify(
+                    img1_path=registered_image_path,
+                    img2_path=login_image_path,
+                    model_name='Facenet',  # Fast and accurate
+                    detector_backend='opencv',  # Fastest backend
+                    enforce_detection=False,  # More lenient face detection
+                    distance_metric='cosine',
+                    threshold=0.6  # More lenient threshold (higher = more lenient)
+                )
+            
+            g.audit_model = 'Facenet'
+            g.audit_distance = result.get('distance')
+            g.audit_threshold = result.get('threshold')
             
             print(f"Verification result: {result}")
             print(f"Distance: {result.get('distance', 'N/A')}")
@@ -309,21 +441,13 @@ def login_face():
             
             if result["verified"] and distance <= threshold:
                 print(f"Face verification successful for {username}!")
+                session_user = load_session_user(username)
+                if not session_user:
+                    return jsonify({"status": "error", "message": "Database error. Please try again."}), 500
                 # Set session for successful face login
                 session['username'] = username
-                session['role'] = user_role
-                # Get email from database for session
-                try:
-                    conn = get_db_connection()
-                    cursor = conn.cursor()
-                    cursor.execute("SELECT email FROM users WHERE username=%s", (username,))
-                    user_row = cursor.fetchone()
-                    if user_row:
-                        session['email'] = user_row[0]
-                    cursor.close()
-                    conn.close()
-                except Exception as e:
-                    print(f"Error getting email for session: {e}")
+                session['email'] = session_user[0]
+                session['role'] = session_user[1] or 'user'
                 
                 return jsonify({"status": "success", "message": f"Face recognized successfully for {username}!"})
             else:
@@ -335,14 +459,19 @@ def login_face():
             # Quick fallback with VGG-Face (also strict)
             try:
                 print(f"Trying fallback verification for {username}...")
-                result = DeepFace.verify(
-                    img1_path=registered_image_path,
-                    img2_path=login_image_path,
-                    model_name='VGG-Face',
-                    detector_backend='opencv',
-                    enforce_detection=False,
-                    threshold=0.6
-                )
+                with g.trace.stage("deepface_verify_vggface"):
+                    result = DeepFace.verify(
+                        img1_path=registered_image_path,
+                        img2_path=login_image_path,
+                        model_name='VGG-Face',
+                        detector_backend='opencv',
+                        enforce_detection=False,
+                        threshold=0.6
+                    )
+                
+                g.audit_model = 'VGG-Face'
+                g.audit_distance = result.get('distance')
+                g.audit_threshold = result.get('threshold')
                 
                 print(f"Fallback verification result: {result}")
                 distance = result.get('distance', 1.0)
@@ -350,21 +479,13 @@ def login_face():
                 
                 if result["verified"] and distance <= threshold:
                     print(f"Fallback face verification successful for {username}!")
+                    session_user = load_session_user(username)
+                    if not session_user:
+                        return jsonify({"status": "error", "message": "Database error. Please try again."}), 500
                     # Set session for successful face login
                     session['username'] = username
-                    session['role'] = user_role
-                    # Get email from database for session
-                    try:
-                        conn = get_db_connection()
-                        cursor = conn.cursor()
-                        cursor.execute("SELECT email FROM users WHERE username=%s", (username,))
-                        user_row = cursor.fetchone()
-                        if user_row:
-                            session['email'] = user_row[0]
-                        cursor.close()
-                        conn.close()
-                    except Exception as e:
-                        print(f"Error getting email for session: {e}")
+                    session['email'] = session_user[0]
+                    session['role'] = session_user[1] or 'user'
                     
                     return jsonify({"status": "success", "message": f"Face recognized successfully for {username}!"})
                 else:
@@ -567,7 +688,7 @@ def api_delete_user(user_id):
         
         # Delete user from database
         cursor.execute("DELETE FROM users WHERE id = %s", (user_id,))
-        conn.commit()
+        commit_user_change(conn, cursor, EVENT_DELETED, username, user_id)
         cursor.close()
         conn.close()
         
@@ -652,5 +773,135 @@ def api_users():
         return jsonify({"error": str(e)}), 500
 
 
+@app.route("/api/audit-log")
+def api_audit_log():
+    """API endpoint to page through authentication attempts - Admin only"""
+    if session.get('role') != 'admin':
+        return jsonify({"error": "Access denied. Admin privileges required."}), 403
+    
+    page = max(request.args.get("page", 1, type=int), 1)
+    per_page = min(max(request.args.get("per_page", 50, type=int), 1), 200)
+    username = request.args.get("username", "").strip()
+    
+    where = ""
+    params = ()
+    if username:
+        where = " WHERE username = %s"
+        params = (username,)
+    
+    try:
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        cursor.execute(f"SELECT COUNT(*) FROM {audit_log.table}{where}", params)
+        total = cursor.fetchone()[0]
+        cursor.execute(
+            f"SELECT id, created_at, method, username, outcome, status_code, distance, threshold, model, latency_ms, remote_addr "
+            f"FROM {audit_log.table}{where} ORDER BY id DESC LIMIT %s OFFSET %s",
+            params + (per_page, (page - 1) * per_page)
+        )
+        rows = cursor.fetchall()
+        cursor.close()
+        conn.close()
+        
+        events = []
+        for row in rows:
+            events.append({
+                "id": row[0],
+                "created_at": row[1].strftime("%Y-%m-%d %H:%M:%S") if row[1] else "N/A",
+                "method": row[2],
+                "username": row[3],
+                "outcome": row[4],
+                "status_code": row[5],
+                "distance": row[6],
+                "threshold": row[7],
+                "model": row[8],
+                "latency_ms": row[9],
+                "remote_addr": row[10]
+            })
+        
+        return jsonify({
+            "events": events,
+            "page": page,
+            "per_page": per_page,
+            "total": total,
+            "pages": (total + per_page - 1) // per_page,
+            "worker_queue": audit_log.stats()
+        })
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+
+@app.route("/api/admin/profile", methods=["POST"])
+def api_start_profile():
+    """Start sampling this worker's request threads for N seconds - Admin only"""
+    if session.get('role') != 'admin':
+        return jsonify({"error": "Access denied. Admin privileges required."}), 403
+    
+    seconds = request.args.get("seconds", 10, type=float)
+    interval = request.args.get("interval", 0.01, type=float)
+    if not (math.isfinite(seconds) and math.isfinite(interval)):
+        return jsonify({"error": "seconds and interval must be finite numbers"}), 400
+    seconds = min(max(seconds, 1), profiling_config["max_profile_seconds"])
+    interval = min(max(interval, 0.001), 1)
+    
+    try:
+        profile_id = sampling_profiler.start(seconds, interval)
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+    if profile_id is None:
+        return jsonify({"error": "A profile is already running"}), 409
+    
+    return jsonify({
+        "status": "started",
+        "profile_id": profile_id,
+        "seconds": seconds,
+        "interval": interval,
+        "pid": os.getpid()
+    }), 202
+
+
+@app.route("/api/admin/profile/<profile_id>")
+def api_get_profile(profile_id):
+    """Return a profile from any worker - Admin only. ?format=collapsed gives flamegraph.pl input"""
+    if session.get('role') != 'admin':
+        return jsonify({"error": "Access denied. Admin privileges required."}), 403
+    
+    try:
+        result = sampling_profiler.get(profile_id)
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+    
+    if result is None:
+        return jsonify({"error": "Profile not found"}), 404
+    if result["status"] == "running":
+        return jsonify({"status": "running", "profile_id": profile_id}), 202
+    if result["status"] == "failed":
+        return jsonify({"error": f"Profile was not completed by worker {result['pid']}"}), 500
+    
+    if request.args.get("format") == "collapsed":
+        response = app.response_class("\n".join(result["collapsed"]) + "\n", mimetype="text/plain")
+        response.headers["Content-Disposition"] = f"attachment; filename=profile_{profile_id}.folded"
+        return response
+    
+    return jsonify(result)
+
+
+@app.route("/api/admin/slow-requests")
+def api_slow_requests():
+    """Stage traces of recent requests over the latency threshold - Admin only"""
+    if session.get('role') != 'admin':
+        return jsonify({"error": "Access denied. Admin privileges required."}), 403
+    
+    try:
+        entries = slow_requests.entries()
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+    
+    return jsonify({
+        "threshold_ms": slow_requests.threshold_ms,
+        "requests": entries
+    })
+
+
 if __name__ == "__main__":
     app.run(debug=True)
@@ -0,0 +1,50 @@
+from batch_writer import BatchWriter
+
+
+AUDIT_COLUMNS = ("method", "username", "outcome", "status_code", "distance",
+                 "threshold", "model", "latency_ms", "remote_addr")
+
+
+class AuditLog(BatchWriter):
+    """
+    Asynchronous authentication audit log.
+
+    `record()` only enqueues the event, so the login path never waits on
+    MySQL. A background thread drains the queue and writes events with one
+    multi-row INSERT per batch. When the queue is full new events are dropped
+    and counted instead of blocking the request.
+    """
+
+    columns = AUDIT_COLUMNS
+    thread_name = "audit-log-writer"
+
+    def __init__(self, get_connection, table="auth_audit_log", max_queue=10000,
+                 batch_size=200, flush_interval=1.0):
+        super().__init__(get_connection, table, max_queue, batch_size, flush_interval)
+
+    def ensure_table(self):
+        conn = self._get_connection()
+        cursor = conn.cursor()
+        cursor.execute(
+            f"CREATE TABLE IF NOT EXISTS {self.table} ("
+            "id BIGINT AUTO_INCREMENT PRIMARY KEY, "
+            "created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP, "
+            "method VARCHAR(16) NOT NULL, "
+            "username VARCHAR(255), "
+            "outcome VARCHAR(16) NOT NULL, "
+            "status_code INT, "
+            "distance FLOAT NULL, "
+            "threshold FLOAT NULL, "
+            "model VARCHAR(50) NULL, "
+            "latency_ms FLOAT, "
+            "remote_addr VARCHAR(64), "
+            "INDEX idx_username (username), "
+            "INDEX idx_created_at (created_at))"
+        )
+        conn.commit()
+        cursor.close()
+        conn.close()
+
+    def record(self, **event):
+        """Enqueue an audit event without blocking. Returns False if it was dropped."""
+        return self._enqueue(tuple(event.get(column) for column in self.columns))
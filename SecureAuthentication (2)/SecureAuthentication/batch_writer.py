@@ -0,0 +1,150 @@
+import atexit
+import os
+import queue
+import threading
+
+
+class BatchWriter:
+    """
+    Bounded in-memory queue drained into a MySQL table by a background thread.
+
+    `_enqueue()` never blocks, so request handlers never wait on MySQL. The
+    writer thread writes rows with one multi-row INSERT per batch. When the
+    queue is full new rows are dropped and counted instead of blocking, and
+    whatever is still queued is flushed at interpreter shutdown.
+
+    Subclasses set `columns` and `thread_name` and implement `ensure_table()`.
+    """
+
+    columns = ()
+    thread_name = "batch-writer"
+
+    def __init__(self, get_connection, table, max_queue=10000, batch_size=200, flush_interval=1.0):
+        self._get_connection = get_connection
+        self.table = table
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._stop = threading.Event()
+        self._thread = None
+        self._thread_lock = threading.Lock()
+        self._counter_lock = threading.Lock()
+        self.dropped = 0
+        self.written = 0
+        self.failed = 0
+        atexit.register(self.stop)
+
+    def ensure_table(self):
+        raise NotImplementedError
+
+    def _enqueue(self, row):
+        """Queue a row without blocking. Returns False if it was dropped."""
+        if self._stop.is_set():
+            # Shutdown flush already ran; nothing would ever write this row.
+            with self._counter_lock:
+                self.dropped += 1
+            return False
+        self.start()
+        try:
+            self._queue.put_nowait(row)
+            return True
+        except queue.Full:
+            with self._counter_lock:
+                self.dropped += 1
+            return False
+
+    def stats(self):
+        """Counters for this process only; they reset when the worker restarts."""
+        return {
+            "pid": os.getpid(),
+            "queued": self._queue.qsize(),
+            "dropped": self.dropped,
+            "written": self.written,
+            "failed": self.failed,
+        }
+
+    def start(self):
+        """Start the writer thread if it is not running (also after a worker fork)."""
+        if self._stop.is_set():
+            return
+        with self._thread_lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._thread = threading.Thread(target=self._run, name=self.thread_name, daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout=5):
+        """Stop the writer thread and flush whatever is still queued."""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+        while True:
+            flushed = self._flush_batch()
+            if flushed == 0:
+                break
+            if flushed < 0:
+                # MySQL is unreachable; retrying every batch would stall shutdown.
+                self._discard_queue()
+                break
+
+    def _discard_queue(self):
+        discarded = 0
+        try:
+            while True:
+                self._queue.get_nowait()
+                discarded += 1
+        except queue.Empty:
+            pass
+        if discarded:
+            print(f"{self.table} writer shutdown: {discarded} queued rows not written")
+            with self._counter_lock:
+                self.failed += discarded
+
+    def _after_insert(self, cursor):
+        """Hook run in the same transaction after each batch INSERT."""
+        pass
+
+    def _next_batch(self, wait):
+        batch = []
+        try:
+            batch.append(self._queue.get(timeout=wait) if wait else self._queue.get_nowait())
+            while len(batch) < self.batch_size:
+                batch.append(self._queue.get_nowait())
+        except queue.Empty:
+            pass
+        return batch
+
+    def _flush_batch(self, wait=None):
+        """Write one batch. Returns its size, 0 if the queue was empty, or -1 if the write failed."""
+        batch = self._next_batch(wait)
+        if not batch:
+            return 0
+        placeholders = ", ".join(["%s"] * len(self.columns))
+        try:
+            conn = self._get_connection()
+            cursor = conn.cursor()
+            # mysql.connector rewrites executemany INSERTs into a single multi-row statement
+            cursor.executemany(
+                f"INSERT INTO {self.table} ({', '.join(self.columns)}) VALUES ({placeholders})",
+                batch
+            )
+            self._after_insert(cursor)
+            conn.commit()
+            cursor.close()
+            conn.close()
+            with self._counter_lock:
+                self.written += len(batch)
+        except Exception as e:
+            print(f"{self.table} flush failed, {len(batch)} rows lost: {e}")
+            with self._counter_lock:
+                self.failed += len(batch)
+            return -1
+        return len(batch)
+
+    def _run(self):
+        try:
+            self.ensure_table()
+        except Exception as e:
+            print(f"{self.table} table check failed: {e}")
+        while not self._stop.is_set():
+            self._flush_batch(wait=self.flush_interval)
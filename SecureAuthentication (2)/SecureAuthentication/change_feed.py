@@ -0,0 +1,225 @@
+import threading
+import time
+from collections import deque
+
+
+EVENT_REGISTERED = "registered"
+EVENT_DELETED = "deleted"
+
+
+class LocalChangeFeed:
+    """
+    In-process pub/sub feed. Events are delivered to subscribers immediately,
+    so publish only after the user change has been committed. Only keeps
+    caches coherent within a single node (development / one worker).
+    """
+
+    # Events cannot ride along in the caller's transaction.
+    transactional = False
+
+    def __init__(self):
+        self._subscribers = []
+        self._lock = threading.Lock()
+        self._next_id = 0
+
+    def subscribe(self, callback):
+        self._subscribers.append(callback)
+
+    def publish(self, event_type, username, user_id=None):
+        with self._lock:
+            self._next_id += 1
+            event = {
+                "id": self._next_id,
+                "event_type": event_type,
+                "username": username,
+                "user_id": user_id,
+            }
+        _dispatch(self._subscribers, event)
+
+    def start(self):
+        pass
+
+    def stop(self):
+        pass
+
+
+class MySQLChangeFeed:
+    """
+    Outbox-table feed shared by every app.py node.
+
+    Writers append a row to the outbox inside the same transaction as the
+    user change, so the event is visible exactly when the change is. Each
+    node tails the table from a background thread and delivers new rows to
+    its subscribers, bounding cache staleness to roughly `poll_interval`.
+    """
+
+    transactional = True
+
+    def __init__(self, get_connection, table="user_changes", poll_interval=0.5,
+                 batch_size=500, overlap=100, retention_seconds=3600):
+        self._get_connection = get_connection
+        self.table = table
+        self.poll_interval = poll_interval
+        self.batch_size = batch_size
+        # Auto-increment ids can become visible out of order when transactions
+        # commit in a different order than they inserted, so every poll
+        # re-reads the last `overlap` ids and skips the ones already delivered.
+        self.overlap = overlap
+        self.retention_seconds = retention_seconds
+        self._subscribers = []
+        self._last_id = None
+        self._seen = deque(maxlen=overlap * 2)
+        self._seen_set = set()
+        self._stop = threading.Event()
+        self._thread = None
+        self._thread_lock = threading.Lock()
+        self._last_prune = 0.0
+
+    def subscribe(self, callback):
+        self._subscribers.append(callback)
+
+    def ensure_table(self):
+        conn = self._get_connection()
+        cursor = conn.cursor()
+        cursor.execute(
+            f"CREATE TABLE IF NOT EXISTS {self.table} ("
+            "id BIGINT AUTO_INCREMENT PRIMARY KEY, "
+            "event_type VARCHAR(32) NOT NULL, "
+            "username VARCHAR(255) NOT NULL, "
+            "user_id INT NULL, "
+            "created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP, "
+            "INDEX idx_created_at (created_at))"
+        )
+        conn.commit()
+        cursor.close()
+        conn.close()
+
+    def publish(self, event_type, username, user_id=None, cursor=None):
+        """
+        Append an event to the outbox. Pass the cursor of the transaction that
+        performs the user change; the caller's commit then publishes the event.
+        """
+        if cursor is not None:
+            cursor.execute(
+                f"INSERT INTO {self.table} (event_type, username, user_id) VALUES (%s, %s, %s)",
+                (event_type, username, user_id)
+            )
+            return
+        conn = self._get_connection()
+        own_cursor = conn.cursor()
+        own_cursor.execute(
+            f"INSERT INTO {self.table} (event_type, username, user_id) VALUES (%s, %s, %s)",
+            (event_type, username, user_id)
+        )
+        conn.commit()
+        own_cursor.close()
+        conn.close()
+
+    def start(self):
+        """
+        Start the tailer thread if it is not running. Safe to call repeatedly;
+        a worker forked from a preloaded app restarts its own tailer this way.
+        """
+        with self._thread_lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="change-feed-tailer", daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout=5):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def _initialize(self):
+        """Create the outbox and start tailing from its current head."""
+        self.ensure_table()
+        conn = self._get_connection()
+        cursor = conn.cursor()
+        cursor.execute(f"SELECT COALESCE(MAX(id), 0) FROM {self.table}")
+        self._last_id = cursor.fetchone()[0]
+        cursor.close()
+        conn.close()
+
+    def poll_once(self):
+        """Deliver any events newer than the last seen id. Returns how many were delivered."""
+        if self._last_id is None:
+            self._initialize()
+        conn = self._get_connection()
+        cursor = conn.cursor()
+        cursor.execute(
+            f"SELECT id, event_type, username, user_id FROM {self.table} "
+            "WHERE id > %s ORDER BY id LIMIT %s",
+            (max(0, self._last_id - self.overlap), self.batch_size + self.overlap)
+        )
+        rows = cursor.fetchall()
+        cursor.close()
+        conn.close()
+
+        delivered = 0
+        for event_id, event_type, username, user_id in rows:
+            if event_id in self._seen_set:
+                continue
+            self._remember(event_id)
+            self._last_id = max(self._last_id, event_id)
+            _dispatch(self._subscribers, {
+                "id": event_id,
+                "event_type": event_type,
+                "username": username,
+                "user_id": user_id,
+            })
+            delivered += 1
+        return delivered
+
+    def prune(self):
+        """Delete outbox rows older than the retention window."""
+        conn = self._get_connection()
+        cursor = conn.cursor()
+        cursor.execute(
+            f"DELETE FROM {self.table} WHERE created_at < NOW() - INTERVAL %s SECOND",
+            (self.retention_seconds,)
+        )
+        conn.commit()
+        cursor.close()
+        conn.close()
+
+    def _remember(self, event_id):
+        if len(self._seen) == self._seen.maxlen:
+            self._seen_set.discard(self._seen[0])
+        self._seen.append(event_id)
+        self._seen_set.add(event_id)
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                # Keep draining while full batches come back, then sleep.
+                while self.poll_once() >= self.batch_size and not self._stop.is_set():
+                    pass
+                now = time.monotonic()
+                if now - self._last_prune > 60:
+                    self._last_prune = now
+                    self.prune()
+            except Exception as e:
+                print(f"Change feed poll failed: {e}")
+            self._stop.wait(self.poll_interval)
+
+
+def commit_with_event(feed, conn, cursor, event_type, username, user_id=None):
+    """Commit a users-table write on `conn` and publish its change event."""
+    if feed.transactional:
+        # Outbox row is committed atomically with the user change
+        feed.publish(event_type, username, user_id, cursor=cursor)
+        conn.commit()
+    else:
+        # Local subscribers run immediately, so invalidate only once committed
+        conn.commit()
+        feed.publish(event_type, username, user_id)
+
+
+def _dispatch(subscribers, event):
+    for callback in subscribers:
+        try:
+            callback(event)
+        except Exception as e:
+            print(f"Change feed subscriber error: {e}")
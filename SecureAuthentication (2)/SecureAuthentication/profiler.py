@@ -0,0 +1,270 @@
+import json
+import os
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+
+from batch_writer import BatchWriter
+
+
+class SamplingProfiler:
+    """
+    Wall-clock sampling profiler for the request-handling threads.
+
+    Request handlers register their thread with `enter_request()` /
+    `exit_request()`. While running, a sampler thread snapshots the Python
+    stacks of the threads currently inside a request with
+    sys._current_frames() at a fixed interval; idle server threads are
+    never sampled. Nothing is hooked into the profiled code, so overhead is
+    one stack walk per request thread per sample. Stacks are aggregated in
+    the collapsed "frame;frame;frame count" format read by flamegraph.pl.
+
+    Each profile is a row in MySQL under a random profile id, inserted as
+    "running" when sampling starts and completed when it ends, so any worker
+    behind the load balancer can report on it.
+    """
+
+    # A running profile not completed this long after its sampling window
+    # ended belongs to a worker that died or lost MySQL.
+    STALE_AFTER_SECONDS = 60
+
+    def __init__(self, get_connection, table="profiles"):
+        self._get_connection = get_connection
+        self.table = table
+        self._lock = threading.Lock()
+        self._thread = None
+        self._request_threads = set()
+
+    def enter_request(self):
+        self._request_threads.add(threading.get_ident())
+
+    def exit_request(self):
+        self._request_threads.discard(threading.get_ident())
+
+    def ensure_table(self):
+        conn = self._get_connection()
+        cursor = conn.cursor()
+        cursor.execute(
+            f"CREATE TABLE IF NOT EXISTS {self.table} ("
+            "profile_id CHAR(32) PRIMARY KEY, "
+            "status VARCHAR(16) NOT NULL, "
+            "pid INT, "
+            "started_at DATETIME, "
+            "seconds FLOAT, "
+            "interval_s FLOAT, "
+            "samples INT, "
+            "collapsed MEDIUMTEXT)"
+        )
+        conn.commit()
+        cursor.close()
+        conn.close()
+
+    def start(self, seconds, interval=0.01):
+        """
+        Sample in the background for `seconds`. Sampling runs on its own
+        thread so that single-threaded (sync) workers keep serving requests
+        while they are being profiled. Returns the profile id, or None if
+        this worker is already profiling. Raises if the "running" row cannot
+        be stored.
+        """
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return None
+            profile_id = uuid.uuid4().hex
+            self.ensure_table()
+            conn = self._get_connection()
+            cursor = conn.cursor()
+            cursor.execute(
+                f"INSERT INTO {self.table} (profile_id, status, pid, started_at, seconds, interval_s) "
+                "VALUES (%s, 'running', %s, %s, %s, %s)",
+                (profile_id, os.getpid(), datetime.now(), seconds, interval)
+            )
+            conn.commit()
+            cursor.close()
+            conn.close()
+            self._thread = threading.Thread(target=self._sample, args=(profile_id, seconds, interval),
+                                            name="sampling-profiler", daemon=True)
+            self._thread.start()
+            return profile_id
+
+    def get(self, profile_id):
+        """
+        The profile as a dict, or None if the id is unknown. `status` is
+        "running", "done", or "failed" when the result was never stored.
+        """
+        conn = self._get_connection()
+        cursor = conn.cursor()
+        cursor.execute(
+            f"SELECT profile_id, pid, started_at, seconds, interval_s, samples, collapsed, status "
+            f"FROM {self.table} WHERE profile_id = %s",
+            (profile_id,)
+        )
+        row = cursor.fetchone()
+        cursor.close()
+        conn.close()
+        if not row:
+            return None
+        status = row[7]
+        if status == "running" and row[2] is not None:
+            finish_by = row[2] + timedelta(seconds=row[3] + self.STALE_AFTER_SECONDS)
+            if datetime.now() > finish_by:
+                status = "failed"
+        return {
+            "profile_id": row[0],
+            "status": status,
+            "pid": row[1],
+            "started_at": row[2].strftime("%Y-%m-%d %H:%M:%S") if row[2] else "N/A",
+            "seconds": row[3],
+            "interval": row[4],
+            "samples": row[5],
+            "collapsed": row[6].splitlines() if row[6] else [],
+        }
+
+    def _sample(self, profile_id, seconds, interval):
+        stacks = Counter()
+        samples = 0
+        deadline = time.monotonic() + seconds
+        while time.monotonic() < deadline:
+            active = set(self._request_threads)
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id in active:
+                    stacks[_fold(frame)] += 1
+            samples += 1
+            time.sleep(interval)
+        collapsed = "\n".join(f"{stack} {count}" for stack, count in stacks.most_common())
+        try:
+            conn = self._get_connection()
+            cursor = conn.cursor()
+            cursor.execute(
+                f"UPDATE {self.table} SET status = 'done', samples = %s, collapsed = %s WHERE profile_id = %s",
+                (samples, collapsed, profile_id)
+            )
+            conn.commit()
+            cursor.close()
+            conn.close()
+        except Exception as e:
+            print(f"Could not store profile {profile_id}: {e}")
+
+
+def _fold(frame):
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append(f"{code.co_name} ({os.path.basename(code.co_filename)})")
+        frame = frame.f_back
+    names.reverse()
+    return ";".join(names)
+
+
+class RequestTrace:
+    """Per-request record of how long each named stage took."""
+
+    def __init__(self, method, path):
+        self.method = method
+        self.path = path
+        self.started_at = time.time()
+        self._start = time.perf_counter()
+        self.stages = []
+
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stages.append((name, (time.perf_counter() - start) * 1000))
+
+    def elapsed_ms(self):
+        return (time.perf_counter() - self._start) * 1000
+
+
+class SlowRequestLog(BatchWriter):
+    """
+    Traces of requests slower than `threshold_ms`, kept in a MySQL table that
+    is trimmed to the newest `capacity` rows so every worker sees the same
+    ring buffer. Traces are queued and written by a background thread, so a
+    slow request never waits on MySQL as well.
+    """
+
+    columns = ("started_at", "pid", "method", "path", "status_code",
+               "total_ms", "unaccounted_ms", "stages")
+    thread_name = "slow-request-writer"
+
+    def __init__(self, get_connection, threshold_ms=2000, capacity=100, table="slow_requests",
+                 max_queue=1000, batch_size=50, flush_interval=1.0):
+        super().__init__(get_connection, table, max_queue, batch_size, flush_interval)
+        self.threshold_ms = threshold_ms
+        self.capacity = capacity
+        self._table_ready = False
+
+    def ensure_table(self):
+        conn = self._get_connection()
+        cursor = conn.cursor()
+        cursor.execute(
+            f"CREATE TABLE IF NOT EXISTS {self.table} ("
+            "id BIGINT AUTO_INCREMENT PRIMARY KEY, "
+            "started_at DATETIME, "
+            "pid INT, "
+            "method VARCHAR(10), "
+            "path VARCHAR(500), "
+            "status_code INT, "
+            "total_ms FLOAT, "
+            "unaccounted_ms FLOAT, "
+            "stages TEXT)"
+        )
+        conn.commit()
+        cursor.close()
+        conn.close()
+        self._table_ready = True
+
+    def maybe_record(self, trace, status_code):
+        """Queue the trace if the request was slow. Returns True if it was queued."""
+        total_ms = trace.elapsed_ms()
+        if total_ms < self.threshold_ms:
+            return False
+        staged_ms = sum(duration for _, duration in trace.stages)
+        stages = [{"name": name, "ms": round(duration, 2)} for name, duration in trace.stages]
+        return self._enqueue((
+            datetime.fromtimestamp(trace.started_at), os.getpid(), trace.method, trace.path[:500],
+            status_code, round(total_ms, 2), round(max(total_ms - staged_ms, 0), 2), json.dumps(stages)
+        ))
+
+    def _after_insert(self, cursor):
+        # Drop everything that has fallen out of the ring
+        cursor.execute(f"SELECT MAX(id) FROM {self.table}")
+        newest = cursor.fetchone()[0]
+        if newest is not None:
+            cursor.execute(f"DELETE FROM {self.table} WHERE id <= %s", (newest - self.capacity,))
+
+    def entries(self):
+        """Most recent first."""
+        if not self._table_ready:
+            self.ensure_table()
+        conn = self._get_connection()
+        cursor = conn.cursor()
+        cursor.execute(
+            f"SELECT started_at, pid, method, path, status_code, total_ms, unaccounted_ms, stages "
+            f"FROM {self.table} ORDER BY id DESC LIMIT %s",
+            (self.capacity,)
+        )
+        rows = cursor.fetchall()
+        cursor.close()
+        conn.close()
+
+        entries = []
+        for row in rows:
+            entries.append({
+                "started_at": row[0].strftime("%Y-%m-%d %H:%M:%S") if row[0] else "N/A",
+                "pid": row[1],
+                "method": row[2],
+                "path": row[3],
+                "status_code": row[4],
+                "total_ms": row[5],
+                "unaccounted_ms": row[6],
+                "stages": json.loads(row[7]) if row[7] else [],
+            })
+        return entries
@@ -0,0 +1,124 @@
+"""
+Tests for the asynchronous audit log, using a fake connection in place of
+MySQL.
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from audit_log import AuditLog
+
+
+class FakeDatabase:
+    """Records every executemany batch; can be switched to fail like a dead server."""
+
+    def __init__(self):
+        self.batches = []
+        self.connects = 0
+        self.down = False
+
+    def connect(self):
+        self.connects += 1
+        if self.down:
+            raise ConnectionError("MySQL unreachable")
+        return FakeConnection(self)
+
+
+class FakeConnection:
+    def __init__(self, db):
+        self.db = db
+
+    def cursor(self):
+        return FakeCursor(self.db)
+
+    def commit(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class FakeCursor:
+    def __init__(self, db):
+        self.db = db
+
+    def execute(self, query, params=()):
+        pass
+
+    def executemany(self, query, rows):
+        self.db.batches.append(list(rows))
+
+    def close(self):
+        pass
+
+
+def make_log(db, **kwargs):
+    audit = AuditLog(db.connect, **kwargs)
+    # Hold the writer back so tests control when the queue is drained
+    audit.start = lambda: None
+    return audit
+
+
+def test_full_queue_drops_and_counts():
+    db = FakeDatabase()
+    audit = make_log(db, max_queue=5)
+
+    accepted = [audit.record(method="email", outcome="failure") for _ in range(8)]
+
+    assert accepted == [True] * 5 + [False] * 3
+    assert audit.stats()["queued"] == 5
+    assert audit.stats()["dropped"] == 3
+
+
+def test_stop_flushes_queue_in_batches():
+    db = FakeDatabase()
+    audit = make_log(db, batch_size=4)
+    for i in range(10):
+        audit.record(method="face", username=f"user{i}", outcome="success", distance=0.3)
+
+    audit.stop()
+
+    assert [len(batch) for batch in db.batches] == [4, 4, 2]
+    assert db.batches[0][0][:3] == ("face", "user0", "success")
+    assert audit.stats()["written"] == 10
+    assert audit.stats()["queued"] == 0
+
+
+def test_records_after_stop_are_dropped():
+    db = FakeDatabase()
+    audit = make_log(db)
+    audit.stop()
+
+    assert audit.record(method="email", outcome="success") is False
+    assert audit.stats()["dropped"] == 1
+    assert audit.stats()["queued"] == 0
+
+
+def test_stop_gives_up_after_first_failed_batch():
+    db = FakeDatabase()
+    audit = make_log(db, batch_size=10)
+    for _ in range(45):
+        audit.record(method="email", outcome="failure")
+    db.down = True
+
+    audit.stop()
+
+    assert db.connects == 1
+    assert audit.stats()["failed"] == 45
+    assert audit.stats()["queued"] == 0
+
+
+def test_background_writer_flushes_without_stop():
+    db = FakeDatabase()
+    audit = AuditLog(db.connect, flush_interval=0.05)
+    audit.record(method="email", username="alice", outcome="success", latency_ms=12.5)
+
+    deadline = time.time() + 5
+    while not db.batches and time.time() < deadline:
+        time.sleep(0.01)
+    audit.stop()
+
+    assert sum(len(batch) for batch in db.batches) == 1
+    assert audit.stats()["written"] == 1
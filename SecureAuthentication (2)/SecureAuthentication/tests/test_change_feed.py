@@ -0,0 +1,123 @@
+"""
+Multi-process convergence test for the MySQL change feed.
+
+Several node processes each tail the outbox with their own MySQLChangeFeed
+and a warm user cache, while this process publishes register and delete
+events. Every node must drop every affected entry; the measured convergence
+times are printed, and only checked against a generous bound of several poll
+intervals so a loaded CI host does not make the test flaky.
+
+Needs a reachable MySQL server, configured with the TEST_DB_* environment
+variables (defaults match db_config in app.py). Skipped otherwise.
+"""
+import multiprocessing
+import os
+import sys
+import time
+import uuid
+
+import pytest
+
+mysql_connector = pytest.importorskip("mysql.connector")
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from change_feed import MySQLChangeFeed, EVENT_REGISTERED, EVENT_DELETED
+
+DB_CONFIG = {
+    "host": os.environ.get("TEST_DB_HOST", "localhost"),
+    "user": os.environ.get("TEST_DB_USER", "root"),
+    "password": os.environ.get("TEST_DB_PASSWORD", ""),
+    "database": os.environ.get("TEST_DB_NAME", "secure")
+}
+
+NODES = 3
+POLL_INTERVAL = 0.2
+# Several poll cycles, covering connection setup and scheduling delays
+CONVERGENCE_BOUND = POLL_INTERVAL * 10
+EVENTS = [
+    (EVENT_REGISTERED, "alice", 1),
+    (EVENT_DELETED, "bob", 2),
+    (EVENT_REGISTERED, "carol", 3),
+    (EVENT_DELETED, "alice", 1),
+]
+
+
+def get_connection():
+    return mysql_connector.connect(**DB_CONFIG)
+
+
+def run_node(table, ready, results):
+    """One app node: a warm cache kept coherent by its own change feed."""
+    cache = {username: ("cached",) for _, username, _ in EVENTS}
+    dropped = []
+
+    def on_user_change(event):
+        cache.pop(event["username"], None)
+        dropped.append((event["event_type"], event["username"], time.time()))
+
+    feed = MySQLChangeFeed(get_connection, table=table, poll_interval=POLL_INTERVAL)
+    feed.subscribe(on_user_change)
+    feed.poll_once()  # position at the head of the outbox before signalling ready
+    feed.start()
+    ready.put(os.getpid())
+
+    deadline = time.time() + 15
+    while len(dropped) < len(EVENTS) and time.time() < deadline:
+        time.sleep(0.01)
+    feed.stop()
+    results.put((os.getpid(), dropped, sorted(cache)))
+
+
+@pytest.fixture
+def outbox_table():
+    try:
+        get_connection().close()
+    except mysql_connector.Error as err:
+        pytest.skip(f"MySQL not reachable: {err}")
+
+    table = f"user_changes_test_{uuid.uuid4().hex[:8]}"
+    MySQLChangeFeed(get_connection, table=table).ensure_table()
+    yield table
+
+    conn = get_connection()
+    cursor = conn.cursor()
+    cursor.execute(f"DROP TABLE IF EXISTS {table}")
+    conn.commit()
+    cursor.close()
+    conn.close()
+
+
+def test_nodes_converge_within_poll_interval(outbox_table):
+    ctx = multiprocessing.get_context("spawn")
+    ready = ctx.Queue()
+    results = ctx.Queue()
+    nodes = [ctx.Process(target=run_node, args=(outbox_table, ready, results)) for _ in range(NODES)]
+    for node in nodes:
+        node.start()
+    for _ in nodes:
+        ready.get(timeout=30)
+
+    publisher = MySQLChangeFeed(get_connection, table=outbox_table)
+    published = []
+    for event_type, username, user_id in EVENTS:
+        publisher.publish(event_type, username, user_id)
+        # Timestamp once committed, i.e. once nodes can actually see the event
+        published.append(time.time())
+        # Spread events over several poll cycles
+        time.sleep(POLL_INTERVAL * 1.5)
+
+    outcomes = [results.get(timeout=30) for _ in nodes]
+    for node in nodes:
+        node.join(10)
+
+    worst = 0.0
+    for pid, dropped, remaining in outcomes:
+        assert remaining == [], f"node {pid} still caches {remaining}"
+        assert [(t, u) for t, u, _ in dropped] == [(t, u) for t, u, _ in EVENTS]
+        delays = [seen - sent for (_, _, seen), sent in zip(dropped, published)]
+        print(f"node {pid}: convergence " + ", ".join(f"{d * 1000:.0f} ms" for d in delays))
+        worst = max(worst, *delays)
+
+    print(f"worst convergence {worst * 1000:.0f} ms, poll_interval {POLL_INTERVAL * 1000:.0f} ms")
+    assert worst <= CONVERGENCE_BOUND
@@ -0,0 +1,154 @@
+"""
+Tests for the registered-user cache and how change events reach it.
+No database needed: rows come from a stub loader and events from
+LocalChangeFeed.
+"""
+import os
+import sys
+import threading
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from change_feed import LocalChangeFeed, EVENT_REGISTERED, EVENT_DELETED, commit_with_event
+from user_cache import RegisteredUserCache
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class FakeUsersTable:
+    """Stands in for the users table; counts loads so tests can see cache hits."""
+
+    def __init__(self):
+        self.rows = {}
+        self.loads = 0
+
+    def load(self, username):
+        self.loads += 1
+        return self.rows.get(username)
+
+
+def test_rows_are_cached_until_invalidated():
+    table = FakeUsersTable()
+    table.rows["alice"] = ("alice", "faces/registered_face_alice.jpg")
+    cache = RegisteredUserCache(table.load)
+
+    assert cache.get("alice") == ("alice", "faces/registered_face_alice.jpg")
+    assert cache.get("alice") == ("alice", "faces/registered_face_alice.jpg")
+    assert table.loads == 1
+
+    table.rows["alice"] = ("alice", "faces/registered_face_alice_v2.jpg")
+    cache.on_change({"event_type": EVENT_REGISTERED, "username": "alice"})
+    assert cache.get("alice") == ("alice", "faces/registered_face_alice_v2.jpg")
+    assert table.loads == 2
+
+
+def test_missing_users_are_not_cached():
+    table = FakeUsersTable()
+    cache = RegisteredUserCache(table.load)
+
+    assert cache.get("bob") is None
+    table.rows["bob"] = ("bob", "faces/registered_face_bob.jpg")
+    assert cache.get("bob") == ("bob", "faces/registered_face_bob.jpg")
+
+
+def test_entries_expire_after_ttl():
+    table = FakeUsersTable()
+    table.rows["alice"] = ("alice", "old.jpg")
+    clock = FakeClock()
+    cache = RegisteredUserCache(table.load, ttl=300, clock=clock)
+
+    cache.get("alice")
+    # A write that bypassed the app published no event
+    table.rows["alice"] = ("alice", "new.jpg")
+    clock.now = 299
+    assert cache.get("alice") == ("alice", "old.jpg")
+    clock.now = 301
+    assert cache.get("alice") == ("alice", "new.jpg")
+
+
+def test_invalidation_during_load_is_not_lost():
+    """A row read before a change must not be cached after that change's event."""
+    table = FakeUsersTable()
+    table.rows["alice"] = ("alice", "old.jpg")
+    loading = threading.Event()
+    release = threading.Event()
+
+    def slow_load(username):
+        row = table.load(username)
+        loading.set()
+        release.wait(5)
+        return row
+
+    cache = RegisteredUserCache(slow_load)
+    reader = threading.Thread(target=cache.get, args=("alice",))
+    reader.start()
+    loading.wait(5)
+
+    # The change commits and its event arrives while the stale SELECT is in flight
+    table.rows["alice"] = ("alice", "new.jpg")
+    cache.on_change({"event_type": EVENT_REGISTERED, "username": "alice"})
+    release.set()
+    reader.join(5)
+
+    assert cache.get("alice") == ("alice", "new.jpg")
+
+
+class FakeConnection:
+    def __init__(self, log):
+        self.log = log
+
+    def commit(self):
+        self.log.append("commit")
+
+
+def test_local_feed_invalidates_only_after_commit():
+    log = []
+    feed = LocalChangeFeed()
+    feed.subscribe(lambda event: log.append(("event", event["event_type"], event["username"])))
+
+    commit_with_event(feed, FakeConnection(log), None, EVENT_DELETED, "alice", 7)
+
+    assert log == ["commit", ("event", EVENT_DELETED, "alice")]
+
+
+def test_local_feed_commit_drives_cache_invalidation():
+    table = FakeUsersTable()
+    table.rows["alice"] = ("alice", "faces/registered_face_alice.jpg")
+    cache = RegisteredUserCache(table.load)
+    feed = LocalChangeFeed()
+    feed.subscribe(cache.on_change)
+
+    cache.get("alice")
+    del table.rows["alice"]
+    commit_with_event(feed, FakeConnection([]), None, EVENT_DELETED, "alice", 7)
+
+    assert cache.get("alice") is None
+
+
+class FakeCursor:
+    def __init__(self, log):
+        self.log = log
+
+    def execute(self, query, params=()):
+        self.log.append(("execute", query.split()[0], params))
+
+
+class FakeTransactionalFeed:
+    transactional = True
+
+    def publish(self, event_type, username, user_id=None, cursor=None):
+        cursor.execute("INSERT INTO user_changes", (event_type, username, user_id))
+
+
+def test_transactional_feed_writes_outbox_before_commit():
+    log = []
+    commit_with_event(FakeTransactionalFeed(), FakeConnection(log), FakeCursor(log),
+                      EVENT_REGISTERED, "alice", 3)
+
+    assert log == [("execute", "INSERT", (EVENT_REGISTERED, "alice", 3)), "commit"]
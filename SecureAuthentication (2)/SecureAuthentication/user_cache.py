@@ -0,0 +1,49 @@
+import threading
+import time
+
+
+class RegisteredUserCache:
+    """
+    Per-process cache of registered-user rows, keyed by username.
+
+    Rows are loaded lazily with `load(username)` and dropped when the change
+    feed reports a register/delete for that username. Only /register and
+    DELETE /api/user/<id> publish events, so every entry also expires after
+    `ttl` seconds as a backstop for other writes to the users table (manual
+    UPDATEs, nodes on older code during a rolling deploy).
+    """
+
+    def __init__(self, load, ttl=300, clock=time.monotonic):
+        self._load = load
+        self.ttl = ttl
+        self._clock = clock
+        self._entries = {}
+        # username -> number of change events seen. A loaded row is only
+        # cached if no event for that username arrived while it was loading,
+        # otherwise a pre-change row could be stored after its invalidation.
+        self._generations = {}
+        self._lock = threading.Lock()
+
+    def get(self, username):
+        with self._lock:
+            entry = self._entries.get(username)
+            if entry is not None and self._clock() < entry[1]:
+                return entry[0]
+            generation = self._generations.get(username, 0)
+
+        row = self._load(username)
+
+        if row:
+            with self._lock:
+                if self._generations.get(username, 0) == generation:
+                    self._entries[username] = (row, self._clock() + self.ttl)
+        return row
+
+    def invalidate(self, username):
+        with self._lock:
+            self._generations[username] = self._generations.get(username, 0) + 1
+            self._entries.pop(username, None)
+
+    def on_change(self, event):
+        """Change feed subscriber."""
+        self.invalidate(event["username"])